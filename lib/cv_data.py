@@ -1,46 +1,340 @@
 """
 Data maintenance
 """
+import argparse
+import concurrent.futures
+import json
 import logging
 import os
+import random
 import shutil
+import time
+from typing import Dict, List, Optional, Tuple
 
 LOG = logging.getLogger(__name__)
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
-DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, "..", "data"))
+REPO_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, ".."))
+DATA_DIR = os.path.join(REPO_DIR, "data")
+# kept outside of the scanned tree: writing it must not change the mtime of a scanned directory
+STATE_FILE = os.path.join(REPO_DIR, "build", "ingest-state.json")
+# a directory modified less than this before its scan is listed again by the next scan (coarse mtime clocks)
+MTIME_UNSAFE_NS = 2 * 10**9
 
 
-def normalize_cv_audio():
+def _mp3_subdir(fname: str) -> str:
     """
-    Ensures that mp3 data is split up in directories named 00-ff based on file's the serial number.
-    It is possible to dump lots of CV mp3 data into data dir, this scripts make sure that data paths are normalized.
+    Name of the 00-ff directory of a CV mp3 file, based on its serial number.
+    """
+    *_, serial = os.path.splitext(fname)[0].split("_")
+    return "{:02x}".format(int(serial) % 256)
+
+
+def _load_state(fpath_state: str, data_dir: str) -> Dict:
+    state = {"data_dir": data_dir, "dirs": {}, "rejected": {}}
+    if os.path.isfile(fpath_state):
+        with open(fpath_state, "r") as fh:
+            saved = json.load(fh)
+        if saved.get("data_dir") == data_dir:
+            state.update(saved)
+        else:
+            LOG.warning(f"State file {fpath_state} belongs to {saved.get('data_dir')}: starting a new scan")
+    return state
+
+
+def _save_state(fpath_state: str, state: Dict) -> None:
+    os.makedirs(os.path.dirname(fpath_state), exist_ok=True)
+    fpath_tmp = f"{fpath_state}.tmp"
+    with open(fpath_tmp, "w") as fh:
+        json.dump(state, fh)
+    os.replace(fpath_tmp, fpath_state)
+
+
+def _scan_dir(dpath: str) -> Dict:
+    """
+    Lists one directory. The mtime is taken *before* listing. A file arriving during the scan may not
+    change the mtime again: it can land in the same tick of the (coarse) filesystem clock.
+    So a directory modified shortly before the scan is not recorded as clean ('mtime_ns' is None)
+    and is listed again by the next scan.
+    """
+    mtime_ns = os.stat(dpath).st_mtime_ns
+    if time.time_ns() - mtime_ns < MTIME_UNSAFE_NS:
+        mtime_ns = None
+    entry = {"mtime_ns": mtime_ns, "subdirs": [], "mp3": []}
+    with os.scandir(dpath) as it:
+        for de in it:
+            if de.is_dir(follow_symlinks=False):
+                entry["subdirs"].append(de.name)
+            elif de.name.endswith(".mp3"):
+                entry["mp3"].append(de.name)
+    return entry
+
+
+def _scan_incremental(data_dir: str, state: Dict) -> int:
+    """
+    Walks 'data_dir', but lists only directories whose mtime changed since the last scan.
+    Adding or removing a file changes the mtime of its directory - not of the parent directories -
+    so the walk still descends into unchanged directories, using their recorded subdirectories.
+
+    :return: number of directories listed
+    """
+    dirs_old: Dict = state["dirs"]
+    dirs_new: Dict = {}
+    n_listed = 0
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        dpath = os.path.join(data_dir, rel)
+        try:
+            mtime_ns = os.stat(dpath).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        entry = dirs_old.get(rel)
+        if entry is None or entry["mtime_ns"] != mtime_ns:
+            entry = _scan_dir(dpath)
+            n_listed += 1
+        dirs_new[rel] = entry
+        stack.extend(os.path.join(rel, d) for d in entry["subdirs"])
+    state["dirs"] = dirs_new
+    return n_listed
+
+
+def _is_mp3(fpath: str) -> bool:
+    """
+    Quick check: non-empty file starting with an ID3 tag or an MPEG frame sync.
+    """
+    with open(fpath, "rb") as fh:
+        head = fh.read(3)
+    if head == b"ID3":
+        return True
+    return len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0
+
+
+_DECODER = None  # one GStreamer pipeline per decode-check process
+
+
+def _init_decoder() -> None:
+    global _DECODER
+    from gst_mp3_loader import Mp3ToTensor  # torch and gi are only needed for the decode-check
+    _DECODER = Mp3ToTensor()
+
+
+def _decode_check(fpath: str) -> Optional[str]:
     """
-    dpath_mp3 = os.path.normpath(os.path.join(DATA_DIR, "mp3"))
-    mv_tasks = []
-    n_mp3 = 0
-    for root, _, fnames in os.walk(DATA_DIR):
-        for fname in [f for f in fnames if f.endswith(".mp3")]:
-            n_mp3 += 1
-            *_, serial = os.path.splitext(fname)[0].split("_")
-            dname: str = "{:02x}".format(int(serial) % 256)
+    :return: None if the file decodes, otherwise the error message
+    """
+    try:
+        tensor = _DECODER.to_tensor(fpath)
+    except Exception as ex:
+        return f"failed to decode ({ex})"
+    return None if tensor.numel() > 0 else "failed to decode (no audio samples)"
+
+
+def _quick_check(src: str, dst: str) -> Optional[str]:
+    """
+    :return: None if 'src' can be ingested, otherwise the reason why not
+    """
+    if src != dst and os.path.isfile(dst):
+        return "already ingested"
+    try:
+        if not _is_mp3(src):
+            return "not an mp3 file"
+    except OSError as ex:
+        return f"failed to read ({ex})"
+    return None
 
-            fpath_src = os.path.join(root, fname)
+
+def _move(src: str, dst: str) -> Optional[str]:
+    """
+    :return: None on success, otherwise the reason why the file was left in place
+    """
+    try:
+        shutil.move(src, dst)
+    except OSError as ex:
+        return f"failed to move ({ex})"
+    return None
+
+
+def _file_key(fpath: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(fpath)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def ingest_cv_audio(data_dir: str = DATA_DIR, jobs: int = 8, decode_check: bool = False,
+                    fpath_state: str = STATE_FILE) -> List[str]:
+    """
+    Incremental, parallel version of 'normalize_cv_audio'.
+    - remembers the scanned directories in 'fpath_state' and lists only the changed ones
+    - checks (mp3 header, duplicates) and moves new files in parallel ('jobs' threads)
+    - optionally decodes every new file with GStreamer before moving it ('jobs' processes)
+    New files already in their 'mp3/00-ff' directory are checked too, but not moved.
+    Invalid files are left where they are and logged once: they are recorded in the state
+    and skipped by later runs as long as their size and mtime do not change.
+
+    :return: sorted list of all valid uids in 'mp3' (e.g. '2f/common_voice_ja_37626159')
+    """
+    data_dir = os.path.normpath(os.path.abspath(data_dir))
+    dpath_mp3 = os.path.join(data_dir, "mp3")
+    state = _load_state(fpath_state, data_dir)
+    known_old = {rel: set(entry["mp3"]) for rel, entry in state["dirs"].items()}
+
+    n_listed = _scan_incremental(data_dir, state)
+    LOG.info(f"Listed {n_listed:5,} of {len(state['dirs']):5,} directories")
+
+    rejected_old: Dict[str, Dict] = state["rejected"]
+    rejected: Dict[str, Dict] = {}
+
+    def reject(src: str, reason: str):
+        LOG.warning(f"Skipped {src}: {reason}")
+        rejected[src] = {"key": _file_key(src), "reason": reason}
+
+    check_tasks: List[Tuple[str, str]] = []
+    targets: Dict[str, str] = {}
+    for rel, entry in state["dirs"].items():
+        for fname in entry["mp3"]:
+            fpath_src = os.path.normpath(os.path.join(data_dir, rel, fname))
+            old = rejected_old.get(fpath_src)
+            if old is not None:
+                key = _file_key(fpath_src)
+                if key == old["key"]:
+                    rejected[fpath_src] = old  # unchanged since it was rejected
+                    continue
+            try:
+                dname = _mp3_subdir(fname)
+            except ValueError:
+                reject(fpath_src, "file name does not end with a serial number")
+                continue
             fpath_trg = os.path.join(dpath_mp3, dname, fname)
             if fpath_src == fpath_trg:
+                if fname in known_old.get(rel, ()):
+                    continue  # checked by an earlier run
+            elif fpath_trg in targets:
+                reject(fpath_src, f"same file name as {targets[fpath_trg]}")
                 continue
-            if not os.path.isfile(fpath_trg):
-                mv_tasks.append((fpath_src, fpath_trg))
+            else:
+                targets[fpath_trg] = fpath_src
+            check_tasks.append((fpath_src, fpath_trg))
+    LOG.info(f"Found {len(check_tasks):5,} new mp3 files")
 
-    dnames = {os.path.dirname(t[1]) for t in mv_tasks}
-    for dname in dnames:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        errors = list(pool.map(lambda t: _quick_check(*t), check_tasks))
+    if decode_check:
+        idx_ok = [i for i, err in enumerate(errors) if err is None]
+        if idx_ok:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_decoder) as pool:
+                for i, err in zip(idx_ok, pool.map(_decode_check, [check_tasks[i][0] for i in idx_ok], chunksize=16)):
+                    errors[i] = err
+    for (src, _), err in zip(check_tasks, errors):
+        if err is not None:
+            reject(src, err)
+    mv_tasks = [t for t, err in zip(check_tasks, errors) if err is None and t[0] != t[1]]
+
+    for dname in {os.path.dirname(t[1]) for t in mv_tasks}:
         os.makedirs(dname, exist_ok=True)
 
-    for src, dst in mv_tasks:
-        shutil.move(src, dst)
-    LOG.info(f"Found {n_mp3:5,} mp3 files")
-    LOG.info(f"Moved {len(mv_tasks):5,} mp3 files")
+    n_moved = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        for (src, _), err in zip(mv_tasks, pool.map(lambda t: _move(*t), mv_tasks)):
+            if err is None:
+                n_moved += 1
+            else:
+                reject(src, err)
+    LOG.info(f"Moved {n_moved:5,} mp3 files")
+    if rejected:
+        LOG.info(f"Skipping {len(rejected):5,} rejected mp3 files (see {fpath_state})")
+
+    # pick up the moves in the (few) touched directories
+    if mv_tasks:
+        _scan_incremental(data_dir, state)
+    state["rejected"] = rejected
+    _save_state(fpath_state, state)
+
+    uids = []
+    for rel, entry in state["dirs"].items():
+        dname = os.path.relpath(os.path.join(data_dir, rel), dpath_mp3)
+        if os.path.dirname(dname) != "" or dname.startswith("."):
+            continue  # not a direct subdirectory of 'mp3'
+        for fname in entry["mp3"]:
+            if os.path.join(dpath_mp3, dname, fname) in rejected:
+                continue
+            try:
+                if _mp3_subdir(fname) != dname:
+                    continue  # misplaced
+            except ValueError:
+                continue
+            uids.append(f"{dname}/{os.path.splitext(fname)[0]}")
+    uids.sort()
+    LOG.info(f"Ingested {len(uids):5,} mp3 files in total")
+    return uids
+
+
+def select_uids(uids: List[str], size: int = None, stratified: bool = False, seed: int = 0) -> List[str]:
+    """
+    :param uids: e.g. output of 'ingest_cv_audio'
+    :param size: number of uids to select, all of them if None
+    :param stratified: select (nearly) the same number of uids from every 00-ff directory
+    :param seed: random seed of the selection
+    """
+    if size is None or size >= len(uids):
+        return list(uids)
+    rnd = random.Random(seed)
+    if not stratified:
+        return rnd.sample(uids, size)
+
+    strata: Dict[str, List[str]] = {}
+    for uid in uids:
+        strata.setdefault(os.path.dirname(uid), []).append(uid)
+    for stratum in strata.values():
+        rnd.shuffle(stratum)
+    # round-robin over shuffled strata
+    keys = sorted(strata)
+    rnd.shuffle(keys)
+    selected = []
+    depth = 0
+    while len(selected) < size:
+        for key in keys:
+            if depth < len(strata[key]):
+                selected.append(strata[key][depth])
+                if len(selected) == size:
+                    break
+        depth += 1
+    return selected
+
+
+def write_uid_file(fpath_uid: str, uids: List[str]) -> None:
+    """
+    Writes a uid manifest as read by 'AudioDataLoader'.
+    """
+    with open(fpath_uid, "w") as fh:
+        for uid in uids:
+            fh.write(f"{uid}\n")
+    LOG.info(f"Wrote {len(uids):5,} uids to {fpath_uid}")
+
+
+def normalize_cv_audio():
+    """
+    Ensures that mp3 data is split up in directories named 00-ff based on file's the serial number.
+    It is possible to dump lots of CV mp3 data into data dir, this scripts make sure that data paths are normalized.
+    """
+    ingest_cv_audio()
 
 
 if __name__ == '__main__':
     logging.basicConfig(format="%(asctime)s [%(levelname)s] %(module)s.%(funcName)s %(message)s", level=logging.DEBUG)
-    normalize_cv_audio()
+    parser = argparse.ArgumentParser(description="Ingest Common Voice mp3 files into 'data/mp3' and write uid manifests")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--state-file", default=STATE_FILE, help="must be outside of the data dir")
+    parser.add_argument("--jobs", type=int, default=8, help="number of parallel moves / decode-checks")
+    parser.add_argument("--decode-check", action="store_true", help="decode every new file before ingesting it")
+    parser.add_argument("--uid-file", help="write uid manifest, e.g. data/sample-100.uid")
+    parser.add_argument("--size", type=int, help="number of uids in the manifest (default: all)")
+    parser.add_argument("--stratified", action="store_true", help="same number of uids from every 00-ff directory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    all_uids = ingest_cv_audio(data_dir=args.data_dir, jobs=args.jobs, decode_check=args.decode_check,
+                               fpath_state=args.state_file)
+    if args.uid_file:
+        write_uid_file(args.uid_file, select_uids(all_uids, size=args.size, stratified=args.stratified, seed=args.seed))
@@ -2,11 +2,16 @@
 Multiprocess dataloader for audio data.
 """
 import os
+import collections
 import logging
+import math
+import queue
 import random
+import threading
 import datetime
-from typing import Callable, List, Dict
+from typing import Callable, List, Dict, Iterable, Iterator, Tuple
 import torch
+import torch.multiprocessing as mp
 
 from gst_mp3_loader import Mp3ToTensor
 
@@ -16,6 +21,21 @@ SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, "..", "data"))
 
 
+def read_uid_file(uid_file: str) -> List[str]:
+    """
+    :param uid_file: one utterance id per line, e.g. '2f/common_voice_ja_37626159'
+    """
+    LOG.debug(f"Loading uid file: {uid_file}")
+    uids = []
+    with open(uid_file, "r") as fh:
+        for line in fh:
+            line = line.strip()
+            if line == "":
+                continue
+            uids.append(line)
+    return uids
+
+
 class AudioData:
     def __init__(self, uid: str = None, path: str = None):
         self.uid = uid
@@ -67,14 +87,7 @@ class AudioDataLoader(torch.utils.data.IterableDataset):
         self.pid = -1
         self._fun_uid2path: Callable = uid2path_fun
         self._data: List[AudioData] = []
-        self._uids: List[str] = [] # this will be copied to all processes
-        LOG.debug(f"Loading uid file: {uid_file}")
-        with open(uid_file, "r") as fh:
-            for line in fh:
-                line = line.strip()
-                if line == "":
-                    continue
-                self._uids.append(line)
+        self._uids: List[str] = read_uid_file(uid_file)  # this will be copied to all processes
         self.gst_pipeline = None  # to be populated in the worker process
 
 
@@ -88,6 +101,232 @@ class AudioDataLoader(torch.utils.data.IterableDataset):
             yield {"label": audio.uid, "samples": tensor}
 
 
+def _warm_worker_main(worker_id: int, task_queue, result_queue, current_epoch):
+    """
+    Main loop of a persistent decode worker.
+    Pays the startup cost (torch/gi imports, Gst.init(), pipeline build) once and then serves epochs until stopped.
+
+    Messages:
+      task_queue   <- ("chunk", epoch, [(uid, path), ...]) files to decode
+                      ("end", epoch, None) no more chunks in this epoch
+                      None to stop
+      result_queue -> ("ready", -1, worker_id, startup_sec) once after start-up
+                      ("fatal", -1, worker_id, message) if the start-up failed; the worker exits
+                      ("sample", epoch, worker_id, {"label": ..., "samples": ...}) for every decoded file
+                      ("error", epoch, worker_id, message) if decoding a file failed
+                      ("done", epoch, worker_id, None) reply to "end"
+
+    Chunks of an epoch other than 'current_epoch' (cancelled by the main process) are skipped.
+    """
+    t0 = datetime.datetime.now()
+    try:
+        gst_pipeline = Mp3ToTensor()
+    except Exception as ex:
+        result_queue.put(("fatal", -1, worker_id, f"failed to build GStreamer pipeline: {ex}"))
+        return
+    result_queue.put(("ready", -1, worker_id, (datetime.datetime.now() - t0).total_seconds()))
+
+    while True:
+        msg = task_queue.get()
+        if msg is None:
+            break
+        msg_type, epoch, tasks = msg
+        if msg_type == "end":
+            result_queue.put(("done", epoch, worker_id, None))
+            continue
+        for uid, path in tasks:
+            if current_epoch.value != epoch:
+                break
+            try:
+                tensor = gst_pipeline.to_tensor(path)
+            except Exception as ex:
+                result_queue.put(("error", epoch, worker_id, f"{uid}: {ex}"))
+                continue
+            result_queue.put(("sample", epoch, worker_id, {"label": uid, "samples": tensor}))
+
+
+class WarmWorkerPool:
+    """
+    Persistent, pre-warmed pool of audio decode workers.
+
+    A new 'torch.utils.data.DataLoader' starts new workers: every worker re-imports torch and gi,
+    calls Gst.init() and builds its own 'Mp3ToTensor' pipeline (see 'AudioDataLoader.init').
+    This pool starts the workers once and keeps them - and their GStreamer pipelines - alive
+    across epochs and across re-configured loaders (batch size, number of workers used).
+
+    Data is sharded like in 'AudioDataLoader.init': by the serial number of the uid.
+    As with 'prefetch_factor' of the DataLoader, a worker is at most 'prefetch_factor' batches ahead of the consumer.
+    """
+    def __init__(self, num_workers: int, uid2path_fun: Callable[[str], str], prefetch_factor: int = 2,
+                 poll_sec: float = 5.0):
+        """
+        Starts 'num_workers' processes and waits until all of them are warmed up.
+
+        :param num_workers: maximum number of workers any epoch can use
+        :param uid2path_fun: maps uid to mp3 path, called in the main process
+        :param prefetch_factor: number of batches decoded in advance by each worker
+        :param poll_sec: how often to check whether the workers are still alive while waiting for results
+        """
+        if prefetch_factor <= 0:
+            raise ValueError(f"prefetch_factor must be positive, got {prefetch_factor}")
+        self._fun_uid2path: Callable = uid2path_fun
+        self._prefetch_factor = prefetch_factor
+        self._poll_sec = poll_sec
+        self._ctx = mp.get_context("fork")
+        self._result_queue = self._ctx.Queue()
+        self._current_epoch = self._ctx.Value("i", -1)
+        self._task_queues = []
+        self._workers = []
+        self.n_epoch = 0
+        self.n_skipped = 0  # files dropped by 'iterate(..., skip_errors=True)'
+
+        t0 = datetime.datetime.now()
+        for worker_id in range(num_workers):
+            task_queue = self._ctx.Queue()
+            proc = self._ctx.Process(target=_warm_worker_main,
+                                     args=(worker_id, task_queue, self._result_queue, self._current_epoch),
+                                     daemon=True)
+            proc.start()
+            self._task_queues.append(task_queue)
+            self._workers.append(proc)
+
+        self.worker_startup_sec = [0.0] * num_workers
+        n_ready = 0
+        try:
+            while n_ready < num_workers:
+                msg_type, _, worker_id, payload = self._get()
+                if msg_type != "ready":
+                    raise RuntimeError(f"Unexpected message from worker {worker_id} during start-up: {msg_type}")
+                self.worker_startup_sec[worker_id] = payload
+                n_ready += 1
+        except BaseException:
+            # 'close' is never reached if the constructor fails: stop the workers that did start
+            for proc in self._workers:
+                proc.terminate()
+            for proc in self._workers:
+                proc.join()
+            raise
+
+        self.startup_sec = (datetime.datetime.now() - t0).total_seconds()
+        LOG.info(f"Warm pool ready: {num_workers} workers in {self.startup_sec:.3f} sec "
+                 f"(slowest pipeline init: {max(self.worker_startup_sec):.3f} sec)")
+
+    @property
+    def num_workers(self) -> int:
+        return len(self._workers)
+
+    def _get(self):
+        """
+        Waits for the next result; raises if a worker died or failed to start.
+        """
+        while True:
+            try:
+                msg = self._result_queue.get(timeout=self._poll_sec)
+            except queue.Empty:
+                for worker_id, proc in enumerate(self._workers):
+                    if not proc.is_alive():
+                        raise RuntimeError(f"Worker {worker_id} (pid {proc.pid}) exited unexpectedly, exitcode={proc.exitcode}")
+                continue
+            if msg[0] == "fatal":
+                raise RuntimeError(f"Worker {msg[2]} failed: {msg[3]}")
+            return msg
+
+    def iterate(self, uids: List[str], batch_size: int, collate_fn: Callable, num_workers: int = None,
+                skip_errors: bool = False) -> Iterator:
+        """
+        Runs one epoch over 'uids' on the warm workers and yields collated batches.
+        Closing the generator early cancels the rest of the epoch.
+
+        :param uids: list of utterance ids
+        :param batch_size: number of samples in a batch (last batch of a worker may be smaller)
+        :param collate_fn: e.g. 'Collator.collate'
+        :param num_workers: number of workers to use, at most the size of the pool (default: all)
+        :param skip_errors: drop files that fail to decode (counted in 'n_skipped') instead of raising,
+                            which is what the DataLoader does
+        """
+        num_workers = self.num_workers if num_workers is None else num_workers
+        if not 0 < num_workers <= self.num_workers:
+            raise ValueError(f"num_workers must be in 1..{self.num_workers}, got {num_workers}")
+        if batch_size <= 0:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+
+        epoch = self.n_epoch
+        self.n_epoch += 1
+        self._current_epoch.value = epoch
+
+        shards = [[] for _ in range(num_workers)]
+        for uid in uids:
+            *_, serial = os.path.basename(uid).split("_")
+            shards[int(serial) % num_workers].append((uid, self._fun_uid2path(uid)))
+        shard_off = [0] * num_workers
+        end_sent = [False] * num_workers
+        n_unconsumed = [0] * num_workers  # sent to the worker, but not yet yielded in a batch (or failed)
+        max_unconsumed = batch_size * self._prefetch_factor
+
+        def feed(worker_id: int):
+            shard = shards[worker_id]
+            while shard_off[worker_id] < len(shard) and n_unconsumed[worker_id] < max_unconsumed:
+                n_task = min(batch_size, max_unconsumed - n_unconsumed[worker_id])
+                chunk = shard[shard_off[worker_id]:shard_off[worker_id] + n_task]
+                self._task_queues[worker_id].put(("chunk", epoch, chunk))
+                shard_off[worker_id] += len(chunk)
+                n_unconsumed[worker_id] += len(chunk)
+            if shard_off[worker_id] == len(shard) and not end_sent[worker_id]:
+                self._task_queues[worker_id].put(("end", epoch, None))
+                end_sent[worker_id] = True
+
+        # as with the DataLoader, a batch is made of samples of the same worker
+        pending: List[List[Dict]] = [[] for _ in range(num_workers)]
+        n_running = num_workers
+        try:
+            for worker_id in range(num_workers):
+                feed(worker_id)
+            while n_running > 0:
+                msg_type, msg_epoch, worker_id, payload = self._get()
+                if msg_epoch != epoch:
+                    continue  # left over from a cancelled epoch
+                if msg_type == "sample":
+                    pending[worker_id].append(payload)
+                    if len(pending[worker_id]) == batch_size:
+                        batch, pending[worker_id] = pending[worker_id], []
+                        yield collate_fn(batch)
+                        n_unconsumed[worker_id] -= len(batch)
+                        feed(worker_id)
+                elif msg_type == "done":
+                    n_running -= 1
+                    if pending[worker_id]:
+                        batch, pending[worker_id] = pending[worker_id], []
+                        yield collate_fn(batch)
+                elif msg_type == "error":
+                    if not skip_errors:
+                        raise RuntimeError(f"Worker {worker_id} failed to decode {payload}")
+                    LOG.error(f"worker {worker_id} failed to decode {payload}")
+                    self.n_skipped += 1
+                    n_unconsumed[worker_id] -= 1
+                    feed(worker_id)
+                else:
+                    raise RuntimeError(f"Unexpected message from worker {worker_id}: {msg_type}")
+        finally:
+            # cancel the remaining chunks if the consumer stopped early; their results are dropped by epoch
+            if self._current_epoch.value == epoch:
+                self._current_epoch.value = -1
+
+    def close(self):
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for proc in self._workers:
+            proc.join(timeout=self._poll_sec)
+            if proc.is_alive():
+                proc.terminate()
+        LOG.info(f"Warm pool closed after {self.n_epoch} epochs, {self.n_skipped} files skipped")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class Collator:
     """
     Runs on the same process as the data loader worker.
@@ -105,13 +344,18 @@ class Collator:
         self.pad_audio = 0
         self.pad_mask = 0
 
-    def collate(self, batch: List[Dict]):
+    def collate(self, batch: List[Dict], alloc: Callable[[str, Tuple[int, ...], torch.dtype], torch.Tensor] = None):
+        """
+        :param alloc: returns the (uninitialized) output matrix for a key, e.g. a slot of 'PinnedBatchRing'
+        """
         tensors = [d["samples"] for d in batch]
         max_len = max(t.size(0) for t in tensors)
 
         # allocate 2D
-        mat_samples = torch.full((len(batch), max_len), fill_value=self.pad_audio, dtype=tensors[0].dtype)
-        mat_mask =  torch.full((len(batch), max_len), fill_value=self.pad_mask, dtype=tensors[0].dtype)
+        if alloc is None:
+            alloc = lambda key, shape, dtype: torch.empty(shape, dtype=dtype)
+        mat_samples = alloc("input_values", (len(batch), max_len), tensors[0].dtype).fill_(self.pad_audio)
+        mat_mask = alloc("attention_mask", (len(batch), max_len), tensors[0].dtype).fill_(self.pad_mask)
         # TODO: pre-allocate matrices in __init__
         # TODO: get max sizes for audio and for labels => possible
 
@@ -129,10 +373,228 @@ class Collator:
 
 
 
-def test_tensor_loader(batch_size=4, num_workers=3) -> None:
+class _RingStopped(Exception):
+    """
+    Raised in the pin thread of 'PinnedBatchRing.pin_iter' when the consumer stopped.
+    """
+
+
+class PinnedBatchRing:
+    """
+    Ring of re-usable pinned (page-locked) host buffers for collated batches. Lives in the main process.
+
+    With 'pin_memory=True' the DataLoader's pin thread allocates new pinned memory for every
+    'input_values' and 'attention_mask' batch. Pinned allocation is slow and fragments host memory
+    when batches are large (long, padded audio). Here batches land in one of 'n_slots'
+    pre-allocated buffers instead, and a buffer is re-used once the consumer releases the batch.
+
+    Two ways to fill a slot:
+    - 'pin_iter': batches collated elsewhere (DataLoader workers) are copied into a slot by a background
+      thread - like the DataLoader's pin thread, the copy is off the consumer thread, but it is one extra copy
+    - 'collate_fn': batches collated in the main process ('WarmWorkerPool') are collated straight into a slot,
+      no extra copy - but it runs on the consumer thread
+
+    Each slot keeps one flat buffer per batch key; a batch of shape (B, T) is a contiguous view
+    of its first B*T elements, so 'tensor.to(device, non_blocking=True)' works on it directly.
+    """
+    KEYS = ("input_values", "attention_mask")
+
+    def __init__(self, n_slots: int = 4, max_numel: int = None, dtype: torch.dtype = torch.int16):
+        """
+        :param n_slots: number of batches that can be held by the consumer or pinned ahead at the same time
+        :param max_numel: length budget: batch size * padded length (number of samples) of the largest batch.
+                          If set, all buffers are allocated here. Otherwise they grow to the largest batch seen,
+                          rounded up to a power of two to keep re-allocations rare.
+        :param dtype: dtype of the collated batches
+        """
+        self._pin = torch.cuda.is_available()
+        if not self._pin:
+            LOG.warning("CUDA is not available: ring buffers are not pinned")
+        self._max_numel = max_numel
+        self._dtype = dtype
+        self._slots: List[Dict[str, torch.Tensor]] = [{} for _ in range(n_slots)]
+        self._free = queue.Queue()
+        for idx in range(n_slots):
+            self._free.put(idx)
+        self._in_use = set()
+        self._lock = threading.Lock()
+        self.n_alloc = 0  # number of (pinned) allocations, ideally 'n_slots' * number of keys
+        if max_numel is not None:
+            for slot in self._slots:
+                for key in self.KEYS:
+                    slot[key] = self._alloc(max_numel)
+
+    @property
+    def n_slots(self) -> int:
+        return len(self._slots)
+
+    def _alloc(self, numel: int) -> torch.Tensor:
+        self.n_alloc += 1
+        return torch.empty(numel, dtype=self._dtype, pin_memory=self._pin)
+
+    def _check(self, key: str, shape: Tuple[int, ...], dtype: torch.dtype) -> None:
+        if key not in self.KEYS:
+            raise ValueError(f"Unexpected batch key '{key}', ring holds {self.KEYS}")
+        if dtype != self._dtype:
+            raise ValueError(f"Batch '{key}' has dtype {dtype}, ring expects {self._dtype}")
+        numel = math.prod(shape)
+        if self._max_numel is not None and numel > self._max_numel:
+            raise ValueError(f"Batch '{key}' of shape {tuple(shape)} exceeds budget of {self._max_numel:,} samples")
+
+    def _acquire(self, block: bool, stop: threading.Event = None) -> int:
+        if not block:
+            try:
+                idx = self._free.get_nowait()
+            except queue.Empty:
+                raise RuntimeError(f"All {self.n_slots} ring slots are in use: release batches or increase 'n_slots'")
+        else:
+            while True:
+                if stop is not None and stop.is_set():
+                    raise _RingStopped()
+                try:
+                    idx = self._free.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    continue
+        with self._lock:
+            self._in_use.add(idx)
+        return idx
+
+    def _view(self, idx: int, key: str, shape: Tuple[int, ...], dtype: torch.dtype) -> torch.Tensor:
+        self._check(key, shape, dtype)
+        numel = math.prod(shape)
+        slot = self._slots[idx]
+        buff = slot.get(key)
+        if buff is None or buff.numel() < numel:
+            buff = slot[key] = self._alloc(1 << (numel - 1).bit_length())
+        return buff[:numel].view(shape)
+
+    def pin(self, batch: Dict[str, torch.Tensor], block: bool = False,
+            stop: threading.Event = None) -> Tuple[int, Dict[str, torch.Tensor]]:
+        """
+        Copies 'batch' into a free slot.
+        :param batch: output of 'Collator.collate'
+        :param block: wait for a free slot (until 'stop' is set) instead of raising
+        :return: slot handle for 'release' and the batch: the same keys, values are views into the slot's pinned buffers
+        """
+        for key, tensor in batch.items():
+            self._check(key, tensor.shape, tensor.dtype)
+        idx = self._acquire(block, stop)
+        pinned = {}
+        for key, tensor in batch.items():
+            view = self._view(idx, key, tensor.shape, tensor.dtype)
+            view.copy_(tensor)
+            pinned[key] = view
+        return idx, pinned
+
+    def pin_iter(self, batches: Iterable[Dict]) -> Iterator[Tuple[int, Dict[str, torch.Tensor]]]:
+        """
+        Pins 'batches' in a background thread, at most 'n_slots' batches ahead of the consumer.
+        :return: (slot, batch) pairs, each slot must be released by the consumer
+        """
+        results = queue.Queue()
+        stop = threading.Event()
+
+        def run():
+            try:
+                for batch in batches:
+                    results.put(("batch", self.pin(batch, block=True, stop=stop)))
+                results.put(("end", None))
+            except _RingStopped:
+                pass  # stopped by the consumer
+            except BaseException as ex:
+                results.put(("error", ex))
+            finally:
+                if hasattr(batches, "close"):
+                    batches.close()
+
+        thread = threading.Thread(target=run, name="pin-ring", daemon=True)
+        thread.start()
+        try:
+            while True:
+                msg_type, payload = results.get()
+                if msg_type == "end":
+                    break
+                if msg_type == "error":
+                    raise payload
+                yield payload
+        finally:
+            stop.set()
+            thread.join()
+            # slots pinned ahead, but never handed out
+            while not results.empty():
+                msg_type, payload = results.get_nowait()
+                if msg_type == "batch":
+                    self.release(payload[0])
+
+    def collate_fn(self, collator: Collator) -> Callable[[List[Dict]], Tuple[int, Dict[str, torch.Tensor]]]:
+        """
+        :return: collate function for 'WarmWorkerPool.iterate' that collates straight into a free slot
+                 and returns (slot, batch)
+        """
+        def collate(samples: List[Dict]) -> Tuple[int, Dict[str, torch.Tensor]]:
+            idx = self._acquire(block=False)
+            try:
+                batch = collator.collate(samples, alloc=lambda key, shape, dtype: self._view(idx, key, shape, dtype))
+            except BaseException:
+                self.release(idx)
+                raise
+            return idx, batch
+        return collate
+
+    def release(self, slot: int) -> None:
+        """
+        Returns a slot to the ring. Its batch must not be used afterwards,
+        including asynchronous copies to the device that are still running.
+        :param slot: handle returned by 'pin', 'pin_iter' or 'collate_fn'
+        """
+        with self._lock:
+            if slot not in self._in_use:
+                raise ValueError(f"Slot {slot} is not in use: released twice or not returned by the ring")
+            self._in_use.remove(slot)
+        self._free.put(slot)
+
+
+def _consume_batches(batches: Iterable, batch_size: int, num_workers: int,
+                     pin_ring: PinnedBatchRing = None) -> float:
+    """
+    Iterates over an epoch of batches (DataLoader or 'WarmWorkerPool.iterate') and logs the loading time.
+    With 'pin_ring' the batches are (slot, batch) pairs of the ring. Half of the slots are held - as by a consumer
+    with asynchronous copies to the GPU in flight - the other half is left for batches pinned ahead.
+    :return: time to the first batch in seconds - includes the worker start-up of a fresh DataLoader
+    """
+    t0 = datetime.datetime.now()
+    first_batch_sec = None
+    held_slots = collections.deque()
+    n_sample, n_batch = 0, 0
+    try:
+        for batch in batches:
+            if first_batch_sec is None:
+                first_batch_sec = (datetime.datetime.now() - t0).total_seconds()
+            if pin_ring is not None:
+                slot, batch = batch
+                held_slots.append(slot)
+                if len(held_slots) > max(1, pin_ring.n_slots // 2):
+                    pin_ring.release(held_slots.popleft())
+            n_batch += 1
+            n_sample_in_batch = batch["input_values"].shape[0]
+            n_sample += n_sample_in_batch
+            LOG.debug(f"batch {n_batch:3d}. size={n_sample_in_batch}")
+    finally:
+        while held_slots:
+            pin_ring.release(held_slots.popleft())
+
+    t1 = datetime.datetime.now()
+    LOG.info(f"Loaded {n_sample:,} samples in\t{n_batch:,}\tbatches - batch-size\t{batch_size}\tnum_worker\t{num_workers}\t{(t1 - t0).total_seconds()}")
+    return first_batch_sec
+
+
+def test_tensor_loader(batch_size=4, num_workers=3, pin_ring: PinnedBatchRing = None) -> float:
     """
     Loads 100 audio in parallel
-    :return:
+    :param pin_ring: pin batches into this ring (in a background thread) instead of letting the DataLoader
+                     allocate pinned memory
+    :return: time to the first batch in seconds
     """
     fpath_uid = os.path.join(DATA_DIR, "sample-100.uid")
 
@@ -140,30 +602,63 @@ def test_tensor_loader(batch_size=4, num_workers=3) -> None:
     data_provider = AudioDataLoader(uid_file=fpath_uid,
                                       uid2path_fun=lambda x: os.path.join(DATA_DIR, "mp3", f"{x}.mp3"))
 
-    t0 = datetime.datetime.now()
     data_loader = torch.utils.data.DataLoader(dataset=data_provider,
                                               batch_size=batch_size, num_workers=num_workers,
                                               worker_init_fn=AudioDataLoader.init,
                                               collate_fn=collator.collate,
-                                              pin_memory=True)
-    n_sample, n_batch = 0, 0
-    for batch in data_loader:
-        n_batch += 1
-        n_sample_in_batch = batch["input_values"].shape[0]
-        n_sample += n_sample_in_batch
-        LOG.debug(f"batch {n_batch:3d}. size={n_sample_in_batch}")
+                                              pin_memory=pin_ring is None)
+    batches = data_loader if pin_ring is None else pin_ring.pin_iter(data_loader)
+    return _consume_batches(batches, batch_size=batch_size, num_workers=num_workers, pin_ring=pin_ring)
 
-    t1 = datetime.datetime.now()
-    LOG.info(f"Loaded {n_sample:,} samples in\t{n_batch:,}\tbatches - batch-size\t{batch_size}\tnum_worker\t{num_workers}\t{(t1 - t0).total_seconds()}")
+
+def test_warm_loader(pool: WarmWorkerPool, batch_size=4, num_workers=3, pin_ring: PinnedBatchRing = None) -> float:
+    """
+    Same as 'test_tensor_loader', but on the already running workers of 'pool'.
+    :param pin_ring: collate straight into the slots of this ring (collating runs in the main process here)
+    :return: time to the first batch in seconds
+    """
+    uids = read_uid_file(os.path.join(DATA_DIR, "sample-100.uid"))
+    collator = Collator()
+    collate_fn = collator.collate if pin_ring is None else pin_ring.collate_fn(collator)
+    batches = pool.iterate(uids, batch_size=batch_size, collate_fn=collate_fn, num_workers=num_workers)
+    return _consume_batches(batches, batch_size=batch_size, num_workers=num_workers, pin_ring=pin_ring)
 
 
-def run_exp1():
-    for batch_size in range(1, 21):
-        for num_workers in range(1, 17):
-            test_tensor_loader(batch_size=batch_size, num_workers=num_workers)
+def run_exp1(warm: bool = False, compare_fresh: bool = True, pin_ring: PinnedBatchRing = None):
+    """
+    :param warm: re-use a single 'WarmWorkerPool' for all configurations instead of a new DataLoader for each
+    :param compare_fresh: in warm mode, also run a fresh DataLoader for each configuration to measure
+                          the start-up time saved (difference of the time to the first batch)
+    :param pin_ring: pin batches into this ring instead of 'pin_memory=True' (shared by all configurations)
+    """
+    if not warm:
+        for batch_size in range(1, 21):
+            for num_workers in range(1, 17):
+                test_tensor_loader(batch_size=batch_size, num_workers=num_workers, pin_ring=pin_ring)
+        if pin_ring is not None:
+            LOG.info(f"Pinned ring: {pin_ring.n_alloc} allocations in {pin_ring.n_slots} slots")
+        return
+
+    saved_sec = 0.0
+    with WarmWorkerPool(num_workers=16, uid2path_fun=lambda x: os.path.join(DATA_DIR, "mp3", f"{x}.mp3")) as pool:
+        for batch_size in range(1, 21):
+            for num_workers in range(1, 17):
+                warm_sec = test_warm_loader(pool, batch_size=batch_size, num_workers=num_workers, pin_ring=pin_ring)
+                if not compare_fresh:
+                    continue
+                fresh_sec = test_tensor_loader(batch_size=batch_size, num_workers=num_workers, pin_ring=pin_ring)
+                saved_sec += fresh_sec - warm_sec
+                LOG.info(f"First batch after - batch-size\t{batch_size}\tnum_worker\t{num_workers}"
+                         f"\tfresh\t{fresh_sec}\twarm\t{warm_sec}\tsaved\t{fresh_sec - warm_sec}")
+    if pin_ring is not None:
+        LOG.info(f"Pinned ring: {pin_ring.n_alloc} allocations in {pin_ring.n_slots} slots")
+    if compare_fresh:
+        LOG.info(f"Warm pool saved {saved_sec:.3f} sec of start-up in total (pool start-up: {pool.startup_sec:.3f} sec)")
 
 
 if __name__ == '__main__':
     logging.basicConfig(format="%(asctime)s [PID:%(process)d] [%(levelname)s] %(module)s.%(funcName)s %(message)s", level=logging.INFO)
     #test_tensor_loader(batch_size=4, num_workers=3)
     run_exp1()
+    # run_exp1(warm=True)
+    # run_exp1(pin_ring=PinnedBatchRing(n_slots=4))
@@ -0,0 +1,4 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "lib")))
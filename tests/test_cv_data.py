@@ -0,0 +1,73 @@
+import logging
+import os
+
+import cv_data
+
+MP3_HEAD = b"ID3\x04\x00\x00"
+
+
+def _write(data_dir, rel, content=MP3_HEAD):
+    fpath = os.path.join(str(data_dir), rel)
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    with open(fpath, "wb") as fh:
+        fh.write(content)
+    return fpath
+
+
+def _ingest(tmp_path):
+    return cv_data.ingest_cv_audio(data_dir=str(tmp_path / "data"), jobs=2,
+                                   fpath_state=str(tmp_path / "state.json"))
+
+
+def test_ingest_moves_new_files_and_skips_rejected(tmp_path, caplog):
+    data_dir = tmp_path / "data"
+    _write(data_dir, "mp3/01/common_voice_ja_1.mp3")
+    _write(data_dir, "mp3/00/common_voice_ja_1.mp3")  # misplaced duplicate
+    _write(data_dir, "mp3/05/notes.mp3")  # no serial number
+    _write(data_dir, "mp3/02/common_voice_ja_2.mp3", b"junk")  # not an mp3
+    _write(data_dir, "drop/common_voice_ja_258.mp3")
+    _write(data_dir, "drop/x/common_voice_ja_259.mp3")
+    _write(data_dir, "drop/y/common_voice_ja_259.mp3")  # same file name
+
+    uids = _ingest(tmp_path)
+
+    assert uids == ["01/common_voice_ja_1", "02/common_voice_ja_258", "03/common_voice_ja_259"]
+    assert os.path.isfile(data_dir / "mp3" / "02" / "common_voice_ja_258.mp3")
+    assert not os.path.exists(data_dir / "drop" / "common_voice_ja_258.mp3")
+    assert os.path.isfile(data_dir / "mp3" / "00" / "common_voice_ja_1.mp3")  # rejected files stay in place
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        assert _ingest(tmp_path) == uids
+    assert not [r for r in caplog.records if r.levelno >= logging.WARNING]
+
+
+def test_ingest_rechecks_changed_rejected_file(tmp_path):
+    data_dir = tmp_path / "data"
+    fpath = _write(data_dir, "drop/common_voice_ja_7.mp3", b"junk")
+    assert _ingest(tmp_path) == []
+
+    _write(data_dir, "drop/common_voice_ja_7.mp3", MP3_HEAD + b"\x00")
+    assert _ingest(tmp_path) == ["07/common_voice_ja_7"]
+    assert not os.path.exists(fpath)
+
+
+def test_scan_does_not_trust_recent_mtime(tmp_path):
+    _write(tmp_path, "common_voice_ja_1.mp3")
+    entry = cv_data._scan_dir(str(tmp_path))
+    assert entry["mtime_ns"] is None
+    assert entry["mp3"] == ["common_voice_ja_1.mp3"]
+
+
+def test_select_uids():
+    uids = [f"{i % 4:02x}/common_voice_ja_{i}" for i in range(40)]
+
+    assert cv_data.select_uids(uids) == uids
+    assert cv_data.select_uids(uids, size=100) == uids
+
+    sample = cv_data.select_uids(uids, size=10, seed=1)
+    assert len(set(sample)) == 10 and set(sample) <= set(uids)
+    assert cv_data.select_uids(uids, size=10, seed=1) == sample
+
+    stratified = cv_data.select_uids(uids, size=8, stratified=True)
+    assert sorted(os.path.dirname(u) for u in stratified) == ["00", "00", "01", "01", "02", "02", "03", "03"]